@@ -1,6 +1,14 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
-from streamlit_app import extract_file_id_from_url, list_files_in_folder, download_file_from_google_drive
+from streamlit_app import (
+    extract_file_id_from_url,
+    list_files_in_folder,
+    download_file_from_google_drive,
+    download_to_path,
+    fetch_many_metadata,
+)
 from io import BytesIO
 
 class TestGoogleDriveFunctions(unittest.TestCase):
@@ -34,64 +42,123 @@ class TestGoogleDriveFunctions(unittest.TestCase):
         self.assertIsNone(extract_file_id_from_url('http://example.com'))
         self.assertIsNone(extract_file_id_from_url(''))
 
-    @patch('requests.get')
-    def test_list_files_in_folder_success(self, mock_get):
-        # Mock successful response with typical Google Drive folder structure
-        mock_response = MagicMock()
-        mock_response.text = '''
-        AF_initDataCallback({
-            data: [
-                [],
-                [
-                    [
-                        ["123456", "test.jpg", "image/jpeg"],
-                        ["789012", "document.pdf", "application/pdf"],
-                        ["345678", "photo.png", "image/png"]
-                    ]
-                ]
-            ],
-            sideChannel: {}
-        });
-        '''
-        mock_response.raise_for_status.return_value = None
-        mock_get.return_value = mock_response
+    @patch('streamlit_app.st.secrets', {'google_api_key': 'test-key'})
+    @patch('streamlit_app.get_drive_service')
+    def test_list_files_in_folder_success(self, mock_get_service):
+        # Mock a Drive listing that spans two pages
+        mock_service = MagicMock()
+        mock_service.files.return_value.list.return_value.execute.side_effect = [
+            {
+                'files': [{'id': '123456', 'name': 'test.jpg'}],
+                'nextPageToken': 'page-2'
+            },
+            {
+                'files': [{'id': '345678', 'name': 'photo.png'}]
+            }
+        ]
+        mock_get_service.return_value = mock_service
 
         files = list_files_in_folder('folder-id')
-        self.assertEqual(len(files), 2)  # Should only include jpg and png files
+        self.assertEqual(len(files), 2)  # Should include both pages
         self.assertEqual(files[0], {'id': '123456', 'name': 'test.jpg'})
         self.assertEqual(files[1], {'id': '345678', 'name': 'photo.png'})
 
-    @patch('requests.get')
-    def test_list_files_in_folder_empty(self, mock_get):
-        mock_response = MagicMock()
-        mock_response.text = 'AF_initDataCallback({data:[], sideChannel: {}});'
-        mock_response.raise_for_status.return_value = None
-        mock_get.return_value = mock_response
+    @patch('streamlit_app.st.secrets', {'google_api_key': 'test-key'})
+    @patch('streamlit_app.get_drive_service')
+    def test_list_files_in_folder_empty(self, mock_get_service):
+        mock_service = MagicMock()
+        mock_service.files.return_value.list.return_value.execute.return_value = {'files': []}
+        mock_get_service.return_value = mock_service
 
         files = list_files_in_folder('folder-id')
         self.assertEqual(files, [])
 
-    @patch('requests.get')
-    def test_list_files_in_folder_error(self, mock_get):
-        mock_get.side_effect = Exception('Network error')
+    @patch('streamlit_app.st.secrets', {'google_api_key': 'test-key'})
+    @patch('streamlit_app.get_drive_service')
+    def test_list_files_in_folder_error(self, mock_get_service):
+        mock_get_service.side_effect = Exception('Network error')
         files = list_files_in_folder('folder-id')
         self.assertEqual(files, [])
 
-    @patch('requests.get')
+    @patch('streamlit_app._SESSION.get')
     def test_download_file_from_google_drive_success(self, mock_get):
         mock_response = MagicMock()
-        mock_response.content = b'fake-image-data'
-        mock_get.return_value = mock_response
+        mock_response.raw = BytesIO(b'fake-image-data')
+        mock_get.return_value.__enter__.return_value = mock_response
 
         result = download_file_from_google_drive('file-id')
         self.assertIsInstance(result, BytesIO)
         self.assertEqual(result.getvalue(), b'fake-image-data')
 
-    @patch('requests.get')
+    @patch('streamlit_app._SESSION.get')
     def test_download_file_from_google_drive_error(self, mock_get):
         mock_get.side_effect = Exception('Network error')
         result = download_file_from_google_drive('file-id')
         self.assertIsNone(result)
 
+    @patch('streamlit_app.get_drive_service')
+    def test_fetch_many_metadata(self, mock_get_service):
+        mock_service = MagicMock()
+
+        def make_batch(callback):
+            batch = MagicMock()
+
+            def run():
+                callback('1', {'id': '123456', 'name': 'test.jpg', 'mimeType': 'image/jpeg'}, None)
+                callback('2', None, Exception('File not found'))
+
+            batch.execute.side_effect = run
+            return batch
+
+        mock_service.new_batch_http_request.side_effect = make_batch
+        mock_get_service.return_value = mock_service
+
+        metadata = fetch_many_metadata(['123456', 'missing'])
+        self.assertEqual(metadata, {
+            '123456': {'id': '123456', 'name': 'test.jpg', 'mimeType': 'image/jpeg'}
+        })
+
+    @patch('streamlit_app._SESSION.get')
+    def test_download_to_path_success(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.raw = BytesIO(b'fake-image-data')
+        mock_get.return_value.__enter__.return_value = mock_response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.jpg')
+            self.assertTrue(download_to_path('file-id', path))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'fake-image-data')
+
+    @patch('streamlit_app._SESSION.get')
+    def test_download_to_path_error(self, mock_get):
+        mock_get.side_effect = Exception('Network error')
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertFalse(download_to_path('file-id', os.path.join(tmp, 'test.jpg')))
+
+    @patch('streamlit_app._SESSION.get')
+    def test_download_to_path_http_error(self, mock_get):
+        # A Drive 403/404 page must not be saved as an image file
+        mock_response = MagicMock()
+        mock_response.raise_for_status.side_effect = Exception('403 Forbidden')
+        mock_get.return_value.__enter__.return_value = mock_response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.jpg')
+            self.assertFalse(download_to_path('file-id', path))
+            self.assertEqual(os.listdir(tmp), [])
+
+    @patch('streamlit_app._SESSION.get')
+    def test_download_to_path_partial_stream(self, mock_get):
+        # A mid-stream failure must not leave a partial file behind
+        mock_response = MagicMock()
+        mock_response.raw.read.side_effect = Exception('Connection reset')
+        mock_get.return_value.__enter__.return_value = mock_response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.jpg')
+            self.assertFalse(download_to_path('file-id', path))
+            self.assertEqual(os.listdir(tmp), [])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file